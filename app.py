@@ -1,7 +1,19 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import csv
+import xlsxwriter
 from io import BytesIO, StringIO
-import chardet
+
+try:
+    from cchardet import detect
+except ImportError:
+    from charset_normalizer import detect
+
+try:
+    from rapidfuzz import fuzz, process
+except ImportError:
+    process = None
 
 # --------------------------------------------------
 # PAGE CONFIG
@@ -23,41 +35,88 @@ fname = uploaded_file.name.lower()
 # --------------------------------------------------
 # HELPERS
 # --------------------------------------------------
-def read_csv_smart(uploaded):
-    uploaded.seek(0)
-    raw = uploaded.read()
-    enc = chardet.detect(raw[:20000])["encoding"] or "utf-8"
-    text = raw.decode(enc, errors="replace")
+def sniff_encoding(raw, limit=20000):
+    if raw.startswith(b"\xef\xbb\xbf"):
+        return "utf-8-sig"
+    try:
+        raw.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+
+    return detect(raw[:limit])["encoding"] or "utf-8"
+
+
+def read_csv_smart(raw):
+    enc = sniff_encoding(raw)
+    first_line = raw.split(b"\n", 1)[0].decode(enc, errors="replace")
+    try:
+        sep = csv.Sniffer().sniff(first_line, delimiters=",;\t|").delimiter
+    except csv.Error:
+        sep = ","
     try:
-        return pd.read_csv(StringIO(text), sep=None, engine="python")
+        return pd.read_csv(BytesIO(raw), sep=sep, engine="c", encoding=enc,
+                           encoding_errors="replace", dtype=str)
     except Exception:
-        return pd.read_csv(StringIO(text))
+        text = raw.decode(enc, errors="replace")
+        return pd.read_csv(StringIO(text), sep=None, engine="python", dtype=str)
 
 
 def df_to_excel_bytes(df, sheet_name="Sheet1"):
+    # constant_memory flushes each row to disk as soon as the next one starts,
+    # so rows must be written in order (pandas' to_excel writes column-wise)
     buffer = BytesIO()
-    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name=sheet_name)
+    workbook = xlsxwriter.Workbook(buffer, {
+        "constant_memory": True,
+        "default_date_format": "YYYY-MM-DD HH:MM:SS",
+    })
+    worksheet = workbook.add_worksheet(sheet_name)
+    header_fmt = workbook.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+
+    worksheet.write_row(0, 0, [str(c) for c in df.columns], header_fmt)
+    for r, row in enumerate(df.itertuples(index=False, name=None), start=1):
+        worksheet.write_row(r, 0, [None if pd.isna(v) else v for v in row])
+
+    workbook.close()
     buffer.seek(0)
     return buffer.getvalue()
 
 
+def find_names(query, names_sorted, names_lower, candidates):
+    # candidates: positions still worth checking for a substring match
+    query = query.lower()
+    exact = candidates[np.char.find(names_lower[candidates], query) >= 0]
+    if process is None or len(exact) > 0:
+        return names_sorted[exact], exact
+
+    # No substring match: fall back to typo-tolerant matches. A cutoff of 85
+    # needs the query to be long enough that one typo still scores that high.
+    hits = process.extract(query, names_lower, scorer=fuzz.partial_ratio,
+                           processor=None, score_cutoff=85, limit=30)
+    return names_sorted[[i for _, _, i in hits]], exact
+
+
 def normalize_columns(df):
-    df.columns = df.columns.map(lambda x: str(x).strip() if pd.notna(x) else "Unnamed")
     cols = pd.Series(df.columns)
-    for dup in cols[cols.duplicated()].unique():
-        idxs = cols[cols == dup].index.tolist()
-        for i, idx in enumerate(idxs):
-            if i > 0:
+    cols = cols.where(cols.notna(), "Unnamed").astype(str).str.strip()
+    dup_no = cols.groupby(cols).cumcount()
+    renamed = pd.Index(np.where(dup_no == 0, cols, cols + "." + dup_no.astype(str)))
+    if not renamed.is_unique:
+        # A generated suffix collided with an existing label; rename in order instead
+        for dup in cols[cols.duplicated()].unique():
+            idxs = cols[cols == dup].index.tolist()
+            for i, idx in enumerate(idxs[1:], start=1):
                 cols[idx] = f"{dup}.{i}"
-    df.columns = cols
+        renamed = cols
+    df.columns = renamed
     return df
 
 # --------------------------------------------------
-# CSV FLOW (UNCHANGED)
+# CACHED LOADERS (keyed on the uploaded bytes, reused across reruns)
 # --------------------------------------------------
-if fname.endswith(".csv"):
-    df = read_csv_smart(uploaded_file)
+@st.cache_data(show_spinner=False)
+def load_pivot(file_bytes):
+    df = read_csv_smart(file_bytes)
     df = normalize_columns(df)
     df = df.dropna(axis=1, how="all")
 
@@ -79,25 +138,40 @@ if fname.endswith(".csv"):
 
     course_cols = [c for c in df.columns if c not in exclude]
 
-    pending_mask = df[course_cols].applymap(
-        lambda x: str(x).strip() == "1" if pd.notna(x) else False
+    # 1 = pending; compare numerically, falling back to text only for
+    # non-blank cells that did not parse
+    course_block = df[course_cols]
+    course_vals = (
+        course_block.apply(pd.to_numeric, errors="coerce")
+        .to_numpy(dtype=float, na_value=np.nan)
     )
+    pending_np = course_vals == 1
+    unparsed = np.isnan(course_vals) & course_block.notna().to_numpy(dtype=bool)
+    for j in np.flatnonzero(unparsed.any(axis=0)):
+        rows = unparsed[:, j]
+        cells = course_block.iloc[:, j].to_numpy(dtype=object)[rows].astype(str)
+        pending_np[rows, j] = np.char.strip(cells) == "1"
 
-    total_courses = len(course_cols)
+    # Dense row-major uint8 matrix so per-row slices and reductions stay contiguous
+    pending_np = np.ascontiguousarray(pending_np, dtype=np.uint8)
 
-    st.metric("Overall Completion %",
-              f"{round((1 - pending_mask.sum().sum() / (len(df) * total_courses)) * 100, 2)}%")
+    # Search keys: stripped name -> row positions, sorted unique names and
+    # a parallel lowercase array
+    names = df[name_col].astype("string").str.strip()
+    name_to_pos = names.groupby(names).indices
+    names_sorted = np.array(sorted(name_to_pos), dtype=str)
+    names_lower = np.char.lower(names_sorted)
+
+    return (df, pending_np, course_cols, name_col, division_col,
+            name_to_pos, names_sorted, names_lower)
 
-# --------------------------------------------------
-# XLSX FLOW (MULTI-SHEET CONSOLIDATION)
-# --------------------------------------------------
-else:
-    xls = pd.ExcelFile(uploaded_file)
-    combined_df = pd.DataFrame()
 
-    for sheet in xls.sheet_names:
-        df_sheet = pd.read_excel(uploaded_file, sheet_name=sheet)
+@st.cache_data(show_spinner=False)
+def load_workbook(file_bytes):
+    sheets = pd.read_excel(BytesIO(file_bytes), sheet_name=None, engine="calamine", dtype=object)
+    parts = []
 
+    for sheet, df_sheet in sheets.items():
         # Header fix
         df_sheet.columns = df_sheet.iloc[0]
         df_sheet = df_sheet[1:]
@@ -116,40 +190,113 @@ else:
         if not division_col:
             continue
 
-        df_tp = df_sheet[df_sheet[division_col].astype(str).str.contains("RMS TP", case=False, na=False)]
-        if df_tp.empty:
-            continue
-
-        df_tp = normalize_columns(df_tp)
-        df_tp["Course Name"] = sheet
+        division = df_sheet[division_col]
+        df_sheet = normalize_columns(df_sheet)
+        df_sheet["Course Name"] = sheet
 
-        name_col = next((c for c in df_tp.columns if "name" in c.lower()), None)
+        name_col = next((c for c in df_sheet.columns if "name" in c.lower()), None)
         if name_col:
-            df_tp = df_tp.rename(columns={name_col: "Employee Name"})
+            df_sheet = df_sheet.rename(columns={name_col: "Employee Name"})
 
-        combined_df = pd.concat([combined_df, df_tp], ignore_index=True)
+        df_sheet["_division"] = division
+        parts.append(df_sheet)
+
+    combined_df = pd.concat(parts, keys=range(len(parts))) if parts else pd.DataFrame()
+
+    # Keep RMS TP rows only, filtered once across all sheets; columns that only
+    # came from sheets without a hit are dropped again
+    if not combined_df.empty:
+        divisions = combined_df.pop("_division").to_numpy(dtype=object, na_value="").astype(str)
+        rms_tp = np.char.find(np.char.lower(divisions), "rms tp") >= 0
+        hit_parts = np.unique(combined_df.index.get_level_values(0)[rms_tp])
+        keep = set().union(*(parts[i].columns for i in hit_parts))
+        combined_df = combined_df.loc[rms_tp, [c for c in combined_df.columns if c in keep]]
+        combined_df = combined_df.reset_index(drop=True)
 
     if combined_df.empty:
-        st.error("No RMS TP data found in Excel.")
-        st.stop()
+        return combined_df, None
 
     combined_df = normalize_columns(combined_df)
 
-    st.success("RMS TP data extracted successfully")
-    st.dataframe(combined_df)
-
     # --------------------------------------------------
     # 🔹 UPDATED PIVOT WITH OFFICE OF WORKING
     # --------------------------------------------------
-    pivot_df = combined_df.pivot_table(
-        index=["Employee Name", "Office of Working"],
-        columns="Course Name",
-        aggfunc="size",
-        fill_value=0
-    ).reset_index()
+    pivot_df = (
+        combined_df.groupby(["Employee Name", "Office of Working", "Course Name"])
+        .size()
+        .unstack("Course Name", fill_value=0)
+        .reset_index()
+    )
 
     pivot_df["Total Courses"] = pivot_df.iloc[:, 2:].sum(axis=1)
 
+    return combined_df, pivot_df
+
+# --------------------------------------------------
+# CSV FLOW (PIVOT + EMPLOYEE SEARCH)
+# --------------------------------------------------
+if fname.endswith(".csv"):
+    (df, pending_np, course_cols, name_col, division_col,
+     name_to_pos, names_sorted, names_lower) = load_pivot(uploaded_file.getvalue())
+
+    total_courses = len(course_cols)
+    if total_courses == 0 or len(df) == 0:
+        st.warning("No course columns or employee rows found in the CSV.")
+        st.stop()
+
+    pending = int(np.count_nonzero(pending_np))
+
+    st.metric("Overall Completion %",
+              f"{round((1 - pending / (len(df) * total_courses)) * 100, 2)}%")
+
+    # --------------------------------------------------
+    # EMPLOYEE SEARCH
+    # --------------------------------------------------
+    st.subheader("🔎 Employee Search")
+    query = st.text_input("Type at least 4 characters of the employee name")
+
+    if len(query) >= 4:
+        # Typing forward only narrows substring matches, so reuse the last hits
+        prev = st.session_state.get("name_search")
+        if prev and prev["file"] == uploaded_file.file_id and prev["query"] in query.lower():
+            candidates = prev["exact"]
+        else:
+            candidates = np.arange(len(names_sorted))
+
+        matches, exact = find_names(query, names_sorted, names_lower, candidates)
+        st.session_state["name_search"] = {
+            "file": uploaded_file.file_id, "query": query.lower(), "exact": exact
+        }
+
+        if len(matches) == 0:
+            st.warning("No matching employee found.")
+        else:
+            chosen_name = st.selectbox("Select employee", matches)
+
+            emp_pending = pending_np[name_to_pos[chosen_name]].any(axis=0)
+            pending_courses = [c for c, p in zip(course_cols, emp_pending) if p]
+
+            st.metric(f"{chosen_name} — Completion %",
+                      f"{round((1 - len(pending_courses) / total_courses) * 100, 2)}%")
+
+            if pending_courses:
+                st.dataframe(pd.DataFrame({"Pending Course": pending_courses}))
+            else:
+                st.success("All courses completed")
+
+# --------------------------------------------------
+# XLSX FLOW (MULTI-SHEET CONSOLIDATION)
+# --------------------------------------------------
+else:
+    combined_df, pivot_df = load_workbook(uploaded_file.getvalue())
+
+    if combined_df.empty:
+        st.error("No RMS TP data found in Excel.")
+        st.stop()
+
+    st.success("RMS TP data extracted successfully")
+    st.dataframe(combined_df)
+
     st.subheader("📊 Pivot: Employee vs Course (with Office)")
     st.dataframe(pivot_df)
 